@@ -2,10 +2,17 @@ import streamlit as st
 import streamlit.components.v1 as components
 import networkx as nx
 import matplotlib.pyplot as plt
-from pyvis.network import Network
 from typing import Iterable, List, Dict
-import itertools
+import functools
+import json
+import math
 import yaml
+
+try:
+    # libyaml-backed loader, much faster than the pure-Python one
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 import pandas as pd
 import textwrap
 from code_editor import code_editor
@@ -22,44 +29,185 @@ COLORS = ["pink", "lightblue", "lightgreen", "yellow", "orange"]
 
 
 def powerset(a: Iterable) -> Iterable[Iterable]:
-    "powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
+    "powerset([1,2,3]) --> () (1,) (2,) (1,2) (3,) (1,3) (2,3) (1,2,3) (bitmask order)"
     s = list(a)
+    n = len(s)
     return [
-        ",\n".join(x)
-        for x in itertools.chain.from_iterable(
-            itertools.combinations(s, r) for r in range(len(s) + 1)
-        )
+        ",\n".join(s[j] for j in range(n) if (i >> j) & 1) if i else ""
+        for i in range(1 << n)
     ]
 
 
+@functools.lru_cache(maxsize=None)
+def wrap_description(description: str) -> str:
+    return "\n".join(textwrap.wrap(description))
+
+
 def range_inclusive(a: Dict) -> Iterable:
-    return list(range(a.get("min"), a.get("max") + 1, a.get("step", 1)))
-
-
-def validate_one(d):
-    try:
-        assert isinstance(d, dict)
-        assert "name" in d
-        assert "tag" in d
-        assert d["tag"] in TAGS
-        assert "choices" in d
-        if isinstance(d["choices"], dict):
-            assert "min" in d["choices"]
-            assert "max" in d["choices"]
-        else:
-            assert len(d["choices"])
-    except AssertionError as e:
-        print(f">>Formatting error in choicepoint `{d['name']}`")
-        raise e
-    return True
+    # a lazy range works everywhere downstream (len, iteration, zip),
+    # so there is no need to materialize the values as a list
+    return range(a["min"], a["max"] + 1, a.get("step", 1))
 
 
 def validate_all(d):
-    assert isinstance(d, list)
-    names = [item["name"] for item in d]
-    assert len(names) == len(set(names))
-    results = list(map(validate_one, d))
-    assert all(results)
+    if not isinstance(d, list):
+        raise ValueError("spec must be a list of choicepoints")
+    seen = set()
+    for item in d:
+        if not isinstance(item, dict) or "name" not in item:
+            raise ValueError("each choicepoint must be a mapping with a `name`")
+        name = item["name"]
+        if name in seen:
+            raise ValueError(f"duplicate choicepoint name `{name}`")
+        seen.add(name)
+        if item.get("tag") not in TAGS:
+            raise ValueError(
+                f"choicepoint `{name}` has invalid tag `{item.get('tag')}`"
+            )
+        if "choices" not in item:
+            raise ValueError(f"choicepoint `{name}` is missing `choices`")
+        choices = item["choices"]
+        if isinstance(choices, dict):
+            if "min" not in choices or "max" not in choices:
+                raise ValueError(
+                    f"choicepoint `{name}` needs `min` and `max` in `choices`"
+                )
+        elif not choices:
+            raise ValueError(f"choicepoint `{name}` has an empty `choices` list")
+
+
+@st.cache_data
+def parse_spec(text: str) -> List[Dict]:
+    # Load the choices from the YAML file and validate
+    d = list(yaml.load_all(text, YamlLoader))
+    validate_all(d)
+
+    # handle keywords (powerset, range, etc.)
+    for item in d:
+        if item.get("choices_operation") == "powerset":
+            item["choices"] = powerset(item["choices"])
+        elif item.get("choices_operation") == "range":
+            item["choices"] = range_inclusive(item["choices"])
+        if item.get("rejected_choices"):
+            rejected = {x["name"] for x in item["rejected_choices"]}
+            item["choices"] = [c for c in item["choices"] if c not in rejected]
+    return d
+
+
+@st.cache_data
+def build_graph_html(yaml_text: str) -> str:
+    d = parse_spec(yaml_text)
+
+    # build Cytoscape elements directly and serialize them to JSON
+    # format each node id exactly once and index into this in both
+    # the node and edge passes below
+    ids_by_level = [
+        [f"{item['name']}::{choice}" for choice in item["choices"]] for item in d
+    ]
+
+    elements = []
+    for i, item in enumerate(d):
+        tag = item["tag"]
+        desc = wrap_description(
+            item.get("description", "TODO: No Description Provided")
+        )
+        box_text = f"Tag: {tag}\n\n{desc}"
+        for choice, node_id in zip(item["choices"], ids_by_level[i]):
+            elements.append(
+                {
+                    "data": {
+                        "id": node_id,
+                        "label": f"{item['name']}\n{choice}",
+                        "title": box_text,
+                    },
+                    "classes": tag,
+                }
+            )
+
+    # route each pair of adjacent levels through an invisible hub node,
+    # so the edge count grows linearly with the number of choices
+    # instead of quadratically
+    for i in range(len(d) - 1):
+        hub = f"hub_{i}"
+        elements.append({"data": {"id": hub}, "classes": "hub"})
+        for node_id in ids_by_level[i]:
+            elements.append({"data": {"source": node_id, "target": hub}})
+        for node_id in ids_by_level[i + 1]:
+            elements.append({"data": {"source": hub, "target": node_id}})
+
+    return GRAPH_TEMPLATE.format(
+        elements_json=json.dumps(elements),
+        style_json=json.dumps(GRAPH_STYLE),
+    )
+
+
+# graph style (Cytoscape stylesheet)
+GRAPH_STYLE = [
+    {
+        "selector": "node",
+        "style": {
+            "shape": "round-rectangle",
+            "label": "data(label)",
+            "text-wrap": "wrap",
+            "text-valign": "center",
+            "text-halign": "center",
+            "width": "label",
+            "height": "label",
+            "padding": "12px",
+            "font-size": 20,
+        },
+    },
+    {
+        "selector": "edge",
+        "style": {
+            "line-color": "gray",
+            "width": 1,
+            "curve-style": "bezier",
+        },
+    },
+    {
+        "selector": ".hub",
+        "style": {
+            "width": 1,
+            "height": 1,
+            "padding": 0,
+            "background-opacity": 0,
+            "label": "",
+        },
+    },
+] + [
+    {"selector": f".{tag}", "style": {"background-color": color}}
+    for tag, color in zip(TAGS, COLORS)
+]
+
+# dagre gives a deterministic hierarchical layout with no physics
+# stabilization loop, which vis.js hierarchical mode was paying for
+GRAPH_TEMPLATE = """<html>
+<head>
+<script src="https://unpkg.com/cytoscape@3.28.1/dist/cytoscape.min.js"></script>
+<script src="https://unpkg.com/dagre@0.8.5/dist/dagre.min.js"></script>
+<script src="https://unpkg.com/cytoscape-dagre@2.5.0/cytoscape-dagre.js"></script>
+</head>
+<body>
+<div id="network" style="width: 100%; height: 700px; background-color: white;"></div>
+<div id="tooltip" style="position: absolute; top: 8px; left: 8px; white-space: pre-line; font-family: sans-serif;"></div>
+<script>
+  const cy = cytoscape({{
+    container: document.getElementById("network"),
+    elements: {elements_json},
+    style: {style_json},
+    layout: {{name: "dagre", rankDir: "TB", nodeSep: 40, rankSep: 60}}
+  }});
+  const tip = document.getElementById("tooltip");
+  cy.on("mouseover", "node", (evt) => {{
+    tip.textContent = evt.target.data("title") || "";
+  }});
+  cy.on("mouseout", "node", () => {{
+    tip.textContent = "";
+  }});
+</script>
+</body>
+</html>"""
 
 
 # set wide layout
@@ -134,112 +282,11 @@ if text == "":
     text = example
 print(response_dict)
 
-# Load the choices from the YAML file and validate
-d = list(yaml.load_all(text, yaml.Loader))
-validate_all(d)
-
-# handle keywords (powerset, range, etc.)
-for item in d:
-    if item.get("choices_operation") == "powerset":
-        item["choices"] = powerset(item["choices"])
-    elif item.get("choices_operation") == "range":
-        item["choices"] = range_inclusive(item["choices"])
-    if item.get("rejected_choices"):
-        item["choices"] = list(
-            set(item["choices"]) - set([x["name"] for x in item["rejected_choices"]])
-        )
-
-all_choices = list(itertools.product(*[item["choices"] for item in d]))
-
-net = Network(
-    height="750px", width="100%", bgcolor="#white", font_color="black", layout=True
-)
-
-color_mapping = dict(zip(TAGS, COLORS))
-
-# add nodes to graph
-for i, item in enumerate(d):
-    for choice in item["choices"]:
-        tag = item["tag"]
-        desc = "\n".join(
-            textwrap.wrap(item.get("description", "TODO: No Description Provided"))
-        )
-        box_text = f"Tag: {tag}\n\n{desc}"
-        net.add_node(
-            f"<b>{item['name']}</b>\n{choice}",
-            level=i,
-            title=box_text,
-            color=color_mapping.get(item["tag"]),
-            shape="box",
-        )
-    # for choice in item.get("rejected_choices", set()):
-    #     net.add_node(
-    #         f"{item['name']}\n{choice['name']}",
-    #         level=i,
-    #         title="\n".join(
-    #             textwrap.wrap(item.get("description", "TODO: No Description Provided"))
-    #         ),
-    #         color="lightgray",
-    #         shape="box",
-    #     )
-
-# names = [item["name"] for item in d]
-
-# add edges to graph
-for a, b in zip(d[:-1], d[1:]):
-    for c, d in itertools.product(a["choices"], b["choices"]):
-        net.add_edge(
-            f"<b>{a['name']}</b>\n{c}", f"<b>{b['name']}</b>\n{d}", color="gray"
-        )
-
-# graph style
-s = """
-const options = {
-  "nodes": {
-    "borderWidth": null,
-    "borderWidthSelected": null,
-    "opacity": null,
-    "size": 32,
-    "font": {
-        "size": 32,
-        "multi": "html"
-    }
-  },
-  "edges": {
-    "color": {
-      "inherit": true
-    },
-    "selfReferenceSize": null,
-    "selfReference": {
-      "angle": 0.7853981633974483
-    },
-    "smooth": {
-      "type": "horizontal",
-      "forceDirection": false
-    }
-  },
-  "layout": {
-    "hierarchical": {
-      "enabled": true
-    }
-  },
-  "physics": {
-    "hierarchicalRepulsion": {
-      "centralGravity": 0,
-      "nodeDistance": 200,
-      "avoidOverlap": 1
-    },
-    "minVelocity": 0.75,
-    "solver": "hierarchicalRepulsion"
-  }
-}
-"""
-net.set_options(s)
+d = parse_spec(text)
 
-net.show("graph.html", notebook=False)
+num_paths = math.prod(len(item["choices"]) for item in d)
 
-HtmlFile = open("graph.html", "r", encoding="utf-8")
-source_code = HtmlFile.read()
+source_code = build_graph_html(text)
 
 st.markdown(
     """### Visualization
@@ -248,7 +295,7 @@ Right-click on this image to save it as a PNG."""
 )
 components.html(source_code, height=600, width=800)
 
-st.markdown(f"### Number of paths through choice space: :orange[{len(all_choices)}]")
+st.markdown(f"### Number of paths through choice space: :orange[{num_paths}]")
 
 st.markdown("## Instructions")
 st.markdown(